@@ -1,9 +1,10 @@
 import os
-import json
-import re
-import math
 import random
 
+import orjson
+
+from trace_parse import TraceStats, batch_trace_stats, load_trace_edges_many, save_cache
+
 # ================= 配置区域 =================
 BASE_DIR = "/home/fengxiaoyu/lx/LLAMA_NEW/data_transform/data/raw/total"
 INPUT_DIRS = {
@@ -29,55 +30,10 @@ SYSTEM_PROMPT = (
 )
 # ===========================================
 
-START_FINISH_RE = re.compile(r"starts\s+at\s*(\d+)\s*ms.*?finishes\s+at\s*(\d+)\s*ms", re.IGNORECASE)
-
-def parse_trace_and_stats(txt: str):
-    """只负责计算基础特征，不包含任何判断逻辑"""
-    durations = []
-    earliest, latest = None, None
-    ann_lines = []
-    lines = [l for l in txt.splitlines() if l.strip()]
-    
-    for raw in lines:
-        line = raw
-        if line.startswith('[') and 'starts at' in line and 'finishes at' in line:
-            m = START_FINISH_RE.search(line)
-            if m:
-                s = int(m.group(1)); f = int(m.group(2))
-                dur = max(0, f-s)
-                durations.append(dur)
-                if line.rstrip().endswith('].'):
-                    line = line[:-2] + f", duration={dur} ms]."
-                elif line.rstrip().endswith(']'):
-                    line = line[:-1] + f", duration={dur} ms]"
-                else:
-                    line = line + f" (duration={dur} ms)"
-                earliest = s if earliest is None else min(earliest, s)
-                latest   = f if latest   is None else max(latest, f)
-        ann_lines.append(line)
-
-    num_edges = len(durations)
-    total = max(0, latest - earliest) if (earliest is not None and latest is not None and latest >= earliest) else sum(durations)
-    mx   = max(durations) if durations else 0
-    avg  = int(sum(durations)/len(durations)) if durations else 0
-    vs   = sorted(durations)
-    idx  = max(0, min(len(vs)-1, math.ceil(0.95 * len(vs)) - 1)) if vs else 0
-    p95  = int(vs[idx]) if vs else 0
-    max_ratio = (mx/total) if total>0 else 0.0
-    b_idx     = durations.index(mx) if durations else -1
-
-    header = (
-        f"# 统计特征\n"
-        f"num_edges={num_edges}\n"
-        f"total_latency_ms={total}\n"
-        f"max_edge_latency_ms={mx}\n"
-        f"mean_edge_latency_ms={avg}\n"
-        f"p95_edge_latency_ms={p95}\n"
-        f"max_edge_ratio={max_ratio:.4f}\n"
-        f"bottleneck_index={b_idx}\n"
-    )
-    
-    return header + "\n" + "\n".join(ann_lines)
+def cook_trace(st: TraceStats) -> str:
+    """统计特征头部 + 追加了 duration 的调用序列（去掉空行）"""
+    body = "\n".join(l for l in st.ann_text.splitlines() if l.strip())
+    return st.header() + "\n" + body
 
 def main():
     random.seed(RANDOM_SEED)
@@ -87,47 +43,56 @@ def main():
     for label_name, dir_list in INPUT_DIRS.items():
         file_paths = []
         for d in dir_list:
-            if not os.path.exists(d): continue
-            for fn in os.listdir(d):
-                if fn.endswith(".txt"):
-                    file_paths.append(os.path.join(d, fn))
+            try:
+                it = os.scandir(d)
+            except FileNotFoundError:
+                continue
+            # DirEntry 自带 name/path，类型信息来自目录项本身，无需逐个 stat
+            with it:
+                file_paths.extend(e.path for e in it if e.name.endswith(".txt") and e.is_file())
         
         if SAMPLES_PER_CLASS and len(file_paths) > SAMPLES_PER_CLASS:
             selected_files = random.sample(file_paths, SAMPLES_PER_CLASS)
         else:
             selected_files = file_paths
 
-        for fp in selected_files:
-            try:
-                with open(fp, "r", encoding="utf-8") as f:
-                    raw = f.read().strip()
-                
-                cooked_content = parse_trace_and_stats(raw)
-                
-                # 构造 User Input
-                # 依然加上 === Data End === 防止续写，但内容里没有任何“提示”
-                input_text = (
-                    "=== Trace Data Start ===\n"
-                    f"{cooked_content}\n"
-                    "=== Trace Data End ===\n\n"
-                    "请根据 System Prompt 中的标准，分析上述数据的 num_edges 和 total_latency_ms，并给出结论。"
-                )
+        # 第一遍：多进程正则扫描（可命中缓存）
+        kept_files, edges = [], []
+        for fp, (e, err) in zip(selected_files, load_trace_edges_many(selected_files)):
+            if err is not None:
+                print(f"Error {fp}: {err}")
+                continue
+            edges.append(e)
+            kept_files.append(fp)
+
+        # 第二遍：整批向量化统计，再逐条拼装样本
+        for fp, st in zip(kept_files, batch_trace_stats(edges)):
+            cooked_content = cook_trace(st)
+
+            # 构造 User Input
+            # 依然加上 === Data End === 防止续写，但内容里没有任何“提示”
+            input_text = (
+                "=== Trace Data Start ===\n"
+                f"{cooked_content}\n"
+                "=== Trace Data End ===\n\n"
+                "请根据 System Prompt 中的标准，分析上述数据的 num_edges 和 total_latency_ms，并给出结论。"
+            )
+
+            sample = {
+                "instruction": SYSTEM_PROMPT, # 规则在这里
+                "input": input_text,          # 数据在这里
+                "output": "",
+                "label": label_name,
+                "id": os.path.basename(fp)
+            }
+            all_samples.append(sample)
 
-                sample = {
-                    "instruction": SYSTEM_PROMPT, # 规则在这里
-                    "input": input_text,          # 数据在这里
-                    "output": "",
-                    "label": label_name,
-                    "id": os.path.basename(fp)
-                }
-                all_samples.append(sample)
-            except Exception as e:
-                print(f"Error {fp}: {e}")
+    save_cache()
 
     random.shuffle(all_samples)
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+    with open(OUTPUT_FILE, "wb", buffering=1 << 20) as f:
         for s in all_samples:
-            f.write(json.dumps(s, ensure_ascii=False) + "\n")
+            f.write(orjson.dumps(s) + b"\n")
 
     print(f"\n✅ 生成完毕: {OUTPUT_FILE}")
     print(f"👀 Prompt 预览 (User):\n{all_samples[0]['input'][-200:]}")
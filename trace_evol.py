@@ -1,7 +1,11 @@
 # tools/synth/trace_evol.py
-import os, re, json, math, random, hashlib
+import os, random, hashlib
 from typing import List, Dict, Any, Tuple
 
+import orjson
+
+from trace_parse import TraceStats, batch_trace_stats, load_trace_edges_many, save_cache
+
 random.seed(2025)
 
 # ====== 你的目录：可以混合真实与合成 ======
@@ -25,69 +29,8 @@ OUT_JSONL = os.path.join(OUT_DIR, "trace_evol_sharegpt4.jsonl")
 MAX_PER_CLASS = 500
 RANDOM_SEED   = 2025
 
-# ====== 正则与工具 ======
-START_FINISH_RE = re.compile(
-    r"starts\s+at\s*(\d+)\s*ms.*?finishes\s+at\s*(\d+)\s*ms",
-    re.IGNORECASE
-)
-
 INSTRUCTION_CORE = "你是一个调用链异常检测器。请根据给定的特征和调用链，仅输出“正常”或“异常”，不要输出其它任何文字。"
 
-def parse_trace_and_stats(txt: str) -> Dict[str, Any]:
-    durations = []
-    earliest, latest = None, None
-    ann_lines = []
-    for raw in txt.splitlines():
-        line = raw
-        if line.startswith('[') and 'starts at' in line and 'finishes at' in line:
-            m = START_FINISH_RE.search(line)
-            if m:
-                s = int(m.group(1)); f = int(m.group(2))
-                dur = max(0, f-s)
-                durations.append(dur)
-                if line.rstrip().endswith('].'):
-                    line = line[:-2] + f", duration={dur} ms]."
-                elif line.rstrip().endswith(']'):
-                    line = line[:-1] + f", duration={dur} ms]"
-                else:
-                    line = line + f" (duration={dur} ms)"
-                earliest = s if earliest is None else min(earliest, s)
-                latest   = f if latest   is None else max(latest, f)
-        ann_lines.append(line)
-
-    num_edges = len(durations)
-    total = max(0, (latest - earliest)) if (earliest and latest and latest>=earliest) else sum(durations)
-    mx   = max(durations) if durations else 0
-    avg  = int(sum(durations)/len(durations)) if durations else 0
-    vs   = sorted(durations)
-    idx  = max(0, min(len(vs)-1, math.ceil(0.95 * len(vs)) - 1)) if vs else 0
-    p95  = int(vs[idx]) if vs else 0
-
-    # 辅助特征
-    max_ratio = (mx/total) if total>0 else 0.0
-    b_idx     = durations.index(mx) if durations else -1
-
-    header = (
-        f"# 统计特征\n"
-        f"num_edges={num_edges}\n"
-        f"total_latency_ms={total}\n"
-        f"max_edge_latency_ms={mx}\n"
-        f"mean_edge_latency_ms={avg}\n"
-        f"p95_edge_latency_ms={p95}\n"
-        f"max_edge_ratio={max_ratio:.4f}\n"
-        f"bottleneck_index={b_idx}\n\n"
-    )
-    cooked_input = header + "\n".join(ann_lines)
-    return {
-        "durations": durations,
-        "max_edge": mx,
-        "bottleneck_index": b_idx,
-        "max_edge_ratio": max_ratio, 
-        "cooked_user": cooked_input,
-        "num_edges": num_edges,       
-        "total_latency_ms": total
-    }
-
 # ====== Evol 问题模板：训练期“多风格指令” ======
 # 最终标签仍只输出“正常/异常”，只是训练时让模型习惯不同问法
 QUESTION_POOL = [
@@ -98,62 +41,57 @@ QUESTION_POOL = [
     "判断：正常 还是 异常？（不要输出其它内容）",
 ]
 
-def build_sharegpt(sample_txt: str, label: str) -> Dict[str, Any]:
-    st = parse_trace_and_stats(sample_txt)
-    q = random.choice(QUESTION_POOL)
-    
-    system_prompt = "你是一个专家级调用链分析师。请先分析Trace的特征，最后给出“正常”或“异常”的结论。"
-    user_content = st["cooked_user"] 
+QUESTION_POOL_T = tuple(QUESTION_POOL)
+
+SYSTEM_PROMPT = "你是一个专家级调用链分析师。请先分析Trace的特征，最后给出“正常”或“异常”的结论。"
+
+# ====== 分析文案模板：模块加载时构造一次，逐条记录只做 % 填充 ======
+ANALYSIS_LEN_SHORT  = "链路节点数 num_edges=%d，链路过短。"
+ANALYSIS_LEN_OK     = "链路节点数 num_edges=%d，结构完整。"
+ANALYSIS_RATIO_HI   = "发现第 %d 条调用耗时占比高达 %.1f%%，存在显著的单点耗时。"
+ANALYSIS_RATIO_MID  = "存在主要耗时节点，占比 %.1f%%。"
+ANALYSIS_RATIO_FLAT = "各节点耗时分布相对均匀。"
+
+# 异常的理由：要么短，要么慢且非核心业务，要么报错(虽然这里没体现)
+# 既然数据里都是 ratio=1.0，说明区别可能在于 total_latency 或者链路结构
+REASON_ABNORMAL_SHORT = "结合极短链路特征，判定为异常中断。"
+REASON_ABNORMAL_SLOW  = "尽管链路完整，但结合高延迟与瓶颈特征，判定为性能异常。"
+# 正常的理由：即使慢，也是正常的慢
+REASON_NORMAL = "该长耗时节点属于核心业务逻辑，符合预期，整体链路正常。"
+
+# 即使是正常样本，如果ratio高，也要承认它高！
+EXPL_TPL = "分析：\n1. %s\n2. %s\n3. %s\n====结论====\n%s"
+
+def build_sharegpt(st: TraceStats, label: str) -> Dict[str, Any]:
+    q = random.choice(QUESTION_POOL_T)
+    user_content = st.header() + "\n" + st.ann_text
 
     # === 动态生成分析文案（核心修改）===
-    
+
     # 1. 分析链路长度
-    if st['num_edges'] <= 2:
-        analysis_len = f"链路节点数 num_edges={st['num_edges']}，链路过短。"
-    else:
-        analysis_len = f"链路节点数 num_edges={st['num_edges']}，结构完整。"
+    short = st.num_edges <= 2
+    analysis_len = (ANALYSIS_LEN_SHORT if short else ANALYSIS_LEN_OK) % st.num_edges
 
     # 2. 分析耗时瓶颈 (根据真实数据说话，不撒谎)
-    ratio = st['max_edge_ratio']
+    ratio = st.max_ratio
     if ratio > 0.9:
-        analysis_ratio = f"发现第 {st['bottleneck_index']} 条调用耗时占比高达 {ratio*100:.1f}%，存在显著的单点耗时。"
+        analysis_ratio = ANALYSIS_RATIO_HI % (st.b_idx, ratio*100)
     elif ratio > 0.5:
-        analysis_ratio = f"存在主要耗时节点，占比 {ratio*100:.1f}%。"
+        analysis_ratio = ANALYSIS_RATIO_MID % (ratio*100)
     else:
-        analysis_ratio = "各节点耗时分布相对均匀。"
+        analysis_ratio = ANALYSIS_RATIO_FLAT
 
     # 3. 生成最终推理逻辑 (这里才是区分正常/异常的关键)
     if label == "异常":
-        # 异常的理由：要么短，要么慢且非核心业务，要么报错(虽然这里没体现)
-        # 既然数据里都是 ratio=1.0，说明区别可能在于 total_latency 或者链路结构
-        if st['num_edges'] <= 2:
-            reason = "结合极短链路特征，判定为异常中断。"
-        else:
-            reason = "尽管链路完整，但结合高延迟与瓶颈特征，判定为性能异常。"
-            
-        explanation = (
-            f"分析：\n"
-            f"1. {analysis_len}\n"
-            f"2. {analysis_ratio}\n"
-            f"3. {reason}\n"
-            f"====结论====\n异常"
-        )
+        reason, verdict = (REASON_ABNORMAL_SHORT if short else REASON_ABNORMAL_SLOW), "异常"
     else:
-        # 正常的理由：即使慢，也是正常的慢
-        reason = "该长耗时节点属于核心业务逻辑，符合预期，整体链路正常。"
-        
-        explanation = (
-            f"分析：\n"
-            f"1. {analysis_len}\n"
-            f"2. {analysis_ratio}\n" # 即使是正常样本，如果ratio高，也要承认它高！
-            f"3. {reason}\n"
-            f"====结论====\n正常"
-        )
+        reason, verdict = REASON_NORMAL, "正常"
+    explanation = EXPL_TPL % (analysis_len, analysis_ratio, reason, verdict)
     # =================================
 
     return {
         "conversations": [
-            {"from": "system",    "value": system_prompt},
+            {"from": "system",    "value": SYSTEM_PROMPT},
             {"from": "user",      "value": user_content + "\n" + q},
             {"from": "assistant", "value": explanation}
         ]
@@ -163,31 +101,40 @@ def iter_txt_files(dirs: List[str]):
     for d in dirs:
         if not os.path.isdir(d):
             continue
-        for fn in sorted(os.listdir(d)):
-            if fn.lower().endswith(".txt"):
-                yield os.path.join(d, fn)
+        with os.scandir(d) as it:
+            entries = [e for e in it if e.name.lower().endswith(".txt") and e.is_file()]
+        entries.sort(key=lambda e: e.name)
+        for e in entries:
+            yield e.path
 
 def main():
     random.seed(RANDOM_SEED)
     recs: List[Dict[str, Any]] = []
     for label, dirs in INPUT_DIRS.items():
-        c = 0
-        for p in iter_txt_files(dirs):
-            if c >= MAX_PER_CLASS:
-                break
-            try:
-                txt = open(p, "r", encoding="utf-8").read().strip()
-                recs.append(build_sharegpt(txt, label))
-                c += 1
-            except Exception as e:
-                print(f"[WARN] skip {p}: {e}")
+        paths = list(iter_txt_files(dirs))
+        c, pos = 0, 0
+        # 按顺序分批交给进程池扫描，读取失败的文件由后面的文件补足
+        while c < MAX_PER_CLASS and pos < len(paths):
+            batch = paths[pos:pos + MAX_PER_CLASS - c]
+            pos += len(batch)
+            edges = []
+            for p, (e, err) in zip(batch, load_trace_edges_many(batch)):
+                if err is not None:
+                    print(f"[WARN] skip {p}: {err}")
+                    continue
+                edges.append(e)
+            # 问法仍取自主进程中全局 random 的同一条序列，按文件顺序逐条抽取
+            for st in batch_trace_stats(edges):
+                recs.append(build_sharegpt(st, label))
+            c += len(edges)
+    save_cache()
 
     random.shuffle(recs)
-    with open(OUT_JSON, "w", encoding="utf-8") as f:
-        json.dump(recs, f, ensure_ascii=False, indent=2)
-    with open(OUT_JSONL, "w", encoding="utf-8") as f:
+    with open(OUT_JSON, "wb") as f:
+        f.write(orjson.dumps(recs, option=orjson.OPT_INDENT_2))
+    with open(OUT_JSONL, "wb", buffering=1 << 20) as f:
         for r in recs:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            f.write(orjson.dumps(r) + b"\n")
 
     valid_endings = 0
     for r in recs:
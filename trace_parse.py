@@ -0,0 +1,236 @@
+# tools/synth/trace_parse.py
+# trace_evol.py 与 build_balanced_testset.py 共用的 Trace 文本解析
+import os
+import re
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 正则扫描结果缓存：path -> (mtime_ns, edges)，mtime 不符即重扫并覆盖；落盘到 data/.cache/ 供两个脚本复用
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(BASE_DIR, "data/.cache")
+CACHE_VERSION = 4  # TraceEdges 结构或扫描结果变化时递增，旧缓存自动失效
+CACHE_FILE = os.path.join(CACHE_DIR, f"trace_edges.v{CACHE_VERSION}.pkl")
+
+# 锚定行首 "["，中间不跨越 "]"，避免 .*? 在整行上回溯；语料全小写，不需要 IGNORECASE
+# MULTILINE 下对整篇文本 sub，每个匹配恰好覆盖一整行（任何部分都不跨越换行）
+START_FINISH_RE = re.compile(
+    r"^\[.*?starts at[^\S\n]*(\d+)[^\S\n]*ms[^\]\n]*?finishes at[^\S\n]*(\d+)[^\S\n]*ms.*$",
+    re.ASCII | re.MULTILINE
+)
+
+
+@dataclass(frozen=True)
+class TraceEdges:
+    """单个 Trace 文件的正则扫描结果"""
+    starts: np.ndarray    # int64
+    finishes: np.ndarray  # int64
+    ann_text: str         # 追加了 duration 的原文（含空行）
+
+
+@dataclass(frozen=True)
+class TraceStats:
+    durations: np.ndarray
+    num_edges: int
+    total: int
+    mx: int
+    avg: int
+    p95: int
+    max_ratio: float
+    b_idx: int
+    ann_text: str
+
+    def header(self) -> str:
+        """统计特征头部，末尾带换行"""
+        return "".join((
+            "# 统计特征\nnum_edges=", str(self.num_edges),
+            "\ntotal_latency_ms=", str(self.total),
+            "\nmax_edge_latency_ms=", str(self.mx),
+            "\nmean_edge_latency_ms=", str(self.avg),
+            "\np95_edge_latency_ms=", str(self.p95),
+            "\nmax_edge_ratio=", format(self.max_ratio, ".4f"),
+            "\nbottleneck_index=", str(self.b_idx), "\n",
+        ))
+
+
+def scan_trace(txt: str) -> TraceEdges:
+    """一次正则 sub 扫过全文：提取每条边的 (start, finish)，并给该行追加 duration"""
+    starts, finishes = [], []
+    add_start = starts.append
+    add_finish = finishes.append
+
+    def annotate(m):
+        s = int(m.group(1)); f = int(m.group(2))
+        add_start(s); add_finish(f)
+        dur = max(0, f-s)
+        line = m.group(0)
+        tail = line.rstrip()[-2:]
+        if tail == '].':
+            return f"{line[:-2]}, duration={dur} ms]."
+        if tail[-1:] == ']':
+            return f"{line[:-1]}, duration={dur} ms]"
+        return f"{line} (duration={dur} ms)"
+
+    ann_text = START_FINISH_RE.sub(annotate, txt)
+    return TraceEdges(
+        starts=np.array(starts, dtype=np.int64),
+        finishes=np.array(finishes, dtype=np.int64),
+        ann_text=ann_text,
+    )
+
+
+def batch_trace_stats(traces: Sequence[TraceEdges]) -> List[TraceStats]:
+    """把多个 Trace 的边拼成一维数组，按段一次性算出各自的统计特征"""
+    n = len(traces)
+    if n == 0:
+        return []
+    counts = np.fromiter((t.starts.shape[0] for t in traces), dtype=np.int64, count=n)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    starts = np.concatenate([t.starts for t in traces])
+    finishes = np.concatenate([t.finishes for t in traces])
+    durs = np.maximum(0, finishes - starts)
+
+    # reduceat 遇到空段会取错元素，只在非空段的起点上归约
+    nonempty = counts > 0
+    seg_starts = offsets[:-1][nonempty]
+    sums = np.zeros(n, dtype=np.int64)
+    mx = np.zeros(n, dtype=np.int64)
+    earliest = np.zeros(n, dtype=np.int64)
+    latest = np.zeros(n, dtype=np.int64)
+    p95 = np.zeros(n, dtype=np.int64)
+    b_idx = np.full(n, -1, dtype=np.int64)
+    if seg_starts.size:
+        sums[nonempty] = np.add.reduceat(durs, seg_starts)
+        mx[nonempty] = np.maximum.reduceat(durs, seg_starts)
+        earliest[nonempty] = np.minimum.reduceat(starts, seg_starts)
+        latest[nonempty] = np.maximum.reduceat(finishes, seg_starts)
+
+        # 段内排序后按 nearest-rank 取 p95：sorted[ceil(0.95*c)-1]
+        seg_id = np.repeat(np.arange(n), counts)
+        sorted_durs = durs[np.lexsort((durs, seg_id))]
+        rank = (19 * counts[nonempty] + 19) // 20 - 1
+        p95[nonempty] = sorted_durs[seg_starts + rank]
+
+        # 每段第一个取到最大值的位置
+        hit = np.flatnonzero(durs == mx[seg_id])
+        hit_seg, first = np.unique(seg_id[hit], return_index=True)
+        b_idx[hit_seg] = hit[first] - offsets[hit_seg]
+
+    avg = np.where(nonempty, sums // np.maximum(counts, 1), 0)
+    total = np.where(nonempty & (latest >= earliest), latest - earliest, sums)
+
+    out = []
+    for i, (c, tot, m, a, p, b) in enumerate(zip(
+            counts.tolist(), total.tolist(), mx.tolist(),
+            avg.tolist(), p95.tolist(), b_idx.tolist())):
+        out.append(TraceStats(
+            durations=durs[offsets[i]:offsets[i + 1]],
+            num_edges=c,
+            total=tot,
+            mx=m,
+            avg=a,
+            p95=p,
+            max_ratio=(m/tot) if tot>0 else 0.0,
+            b_idx=b,
+            ann_text=traces[i].ann_text,
+        ))
+    return out
+
+
+def parse_trace_and_stats(txt: str) -> TraceStats:
+    """只负责计算基础特征，不包含任何判断逻辑"""
+    return batch_trace_stats([scan_trace(txt)])[0]
+
+
+# ====== 磁盘缓存 ======
+_disk_cache: Dict[str, Tuple[int, TraceEdges]] = None
+_updates: Dict[str, Tuple[int, TraceEdges]] = {}  # 本进程新扫描的条目，save_cache 时合并回磁盘
+
+def _read_cache_file() -> Dict[str, Tuple[int, TraceEdges]]:
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    try:
+        with open(CACHE_FILE, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print(f"[WARN] ignore broken cache {CACHE_FILE}: {e}")
+        return {}
+
+def _get_disk_cache() -> Dict[str, Tuple[int, TraceEdges]]:
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = _read_cache_file()
+    return _disk_cache
+
+def _scan_one(path: str) -> Tuple[Optional[TraceEdges], Optional[str]]:
+    """子进程入口：读取并扫描一个文件，异常转成字符串带回主进程"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return scan_trace(f.read().strip()), None
+    except Exception as e:
+        return None, str(e)
+
+def load_trace_edges_many(paths: Sequence[str], max_workers: int = None
+                          ) -> List[Tuple[Optional[TraceEdges], Optional[str]]]:
+    """批量读取并扫描 Trace 文件：命中缓存（内存中的 _disk_cache）直接复用，未命中的交给进程池并行扫描
+
+    返回与 paths 一一对应的 (edges, error)，成功时 error 为 None。
+    """
+    cache = _get_disk_cache()
+    results: List[Tuple[Optional[TraceEdges], Optional[str]]] = [None] * len(paths)
+    miss_idx, miss_keys = [], []
+    for i, p in enumerate(paths):
+        p = os.path.abspath(p)
+        try:
+            mtime_ns = os.stat(p).st_mtime_ns
+        except OSError as e:
+            results[i] = (None, str(e))
+            continue
+        hit = cache.get(p)
+        if hit is not None and hit[0] == mtime_ns:
+            results[i] = (hit[1], None)
+        else:
+            miss_idx.append(i); miss_keys.append((p, mtime_ns))
+
+    if len(miss_keys) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as ex:
+            scanned = list(ex.map(_scan_one, [k[0] for k in miss_keys], chunksize=32))
+    else:
+        scanned = [_scan_one(k[0]) for k in miss_keys]
+
+    for i, key, res in zip(miss_idx, miss_keys, scanned):
+        results[i] = res
+        if res[0] is not None:
+            path, mtime_ns = key
+            cache[path] = _updates[path] = (mtime_ns, res[0])
+    return results
+
+def save_cache() -> None:
+    """把本次新扫描的条目合并回 data/.cache/
+
+    先重新读取磁盘上的最新缓存再合并，另一个脚本同时写入的条目不会被整份覆盖；
+    同一路径以 mtime 较新的为准，并剔除文件已删除或已被修改（mtime 不符）的条目。
+    """
+    if not _updates:
+        return
+    merged = _read_cache_file()
+    for path, entry in _updates.items():
+        old = merged.get(path)
+        if old is None or old[0] <= entry[0]:
+            merged[path] = entry
+    for path, (mtime_ns, _) in list(merged.items()):
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                del merged[path]
+        except OSError:
+            del merged[path]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(merged, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, CACHE_FILE)
+    _updates.clear()
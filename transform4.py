@@ -1,8 +1,12 @@
+import gc
 import pickle
+import functools
+import itertools
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List
-import networkx as nx
+from multiprocessing import Pool
+from operator import attrgetter
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
 
 @dataclass
@@ -33,19 +37,31 @@ class Trace:
     anomaly_type: int = None  # normal:0/only_latency_anomaly:1/only_structure_anomaly:2/both_anomaly:3
 
 
+@functools.lru_cache(maxsize=4096)
 def get_communication_type(operation_name: str) -> str:
-    """根据操作名称推断通信类型"""
+    """根据操作名称推断通信类型（操作名种类远少于 Span 数，结果按名字缓存）"""
     if operation_name is None:
         return "UNKNOWN"
-    if "HTTP" in operation_name.upper():
+    s = operation_name.casefold()
+    if "http" in s:
         return "HTTP"
-    if "grpc" in operation_name.lower():
+    if "grpc" in s:
         return "GRPC"
-    if "DB" in operation_name.upper() or "SQL" in operation_name.upper():
+    if "db" in s or "sql" in s:
         return "DATABASE"
     return "RPC"
 
 
+# Edge 编码的固定片段，format_edge 中直接 join，避免 f-string 逐个 __format__
+_EDGE_PRE = "[Edge ID is "
+_EDGE_SRC = ", Source is "
+_EDGE_DST = ", Destination is "
+_EDGE_TYPE = ", Type is "
+_EDGE_START = ", Communication starts at "
+_EDGE_FINISH = " ms, Communication finishes at "
+_EDGE_END = " ms]."
+
+
 def format_edge(span: Span, parent_span: Span = None) -> str:
     """将单个 Span 转换为论文要求的 Edge 编码格式"""
     edge_id = span.span_id
@@ -55,99 +71,126 @@ def format_edge(span: Span, parent_span: Span = None) -> str:
     start_time = int(span.start_time.timestamp() * 1000)  # 转毫秒
     finish_time = start_time + int(span.duration)
 
-    return (f"[Edge ID is {edge_id}, Source is {source}, Destination is {destination}, "
-            f"Type is {communication_type}, Communication starts at {start_time} ms, "
-            f"Communication finishes at {finish_time} ms].")
-
-
-def extract_spans(span: Span, spans=None):
-    """递归提取 Span 树中的所有 Span"""
-    if spans is None:
-        spans = []
-    spans.append(span)
-    for child_span in span.children_span_list:
-        extract_spans(child_span, spans)
-    return spans
-
-
-def build_dependency_graph(spans: List[Span]) -> nx.DiGraph:
-    """构建跨 Trace 的依赖关系图 (Dependency Graph)"""
-    graph = nx.DiGraph()
-
-    # 添加节点
-    for span in spans:
-        graph.add_node(span.span_id, span=span)
-
-    # 添加父子依赖关系
-    for span in spans:
-        if span.parent_span_id and span.parent_span_id in graph.nodes:
-            graph.add_edge(span.parent_span_id, span.span_id, type='parent')
-
-    # 添加时间邻接依赖关系
-    sorted_spans = sorted(spans, key=lambda s: s.start_time)
-    for i in range(len(sorted_spans) - 1):
-        current_span = sorted_spans[i]
-        next_span = sorted_spans[i + 1]
-        time_gap = (next_span.start_time - current_span.start_time).total_seconds()
-        if 0 < time_gap <= 2:  # 两个 Span 间隔小于2秒视为有关联
-            graph.add_edge(current_span.span_id, next_span.span_id, type='time')
-
-    return graph
-
-
-def generate_sequence(graph: nx.DiGraph) -> List[str]:
-    """根据依赖关系图生成完整的 Trace 序列"""
-    try:
-        ordered_nodes = list(nx.topological_sort(graph))
-    except nx.NetworkXUnfeasible:
-        print("检测到循环依赖！")
-        ordered_nodes = list(graph.nodes)
-
-    sequence = []
-    for node_id in ordered_nodes:
-        span = graph.nodes[node_id]['span']
-        parent_node = list(graph.predecessors(node_id))
-        parent_span = graph.nodes[parent_node[0]]['span'] if parent_node else None
-        sequence.append(format_edge(span, parent_span))
-    return sequence
+    return "".join((
+        _EDGE_PRE, str(edge_id),
+        _EDGE_SRC, str(source),
+        _EDGE_DST, str(destination),
+        _EDGE_TYPE, communication_type,
+        _EDGE_START, str(start_time),
+        _EDGE_FINISH, str(finish_time),
+        _EDGE_END,
+    ))
+
+
+_by_start = attrgetter('start_time')
+
+
+def extract_spans(root: Span) -> Tuple[List[Span], Dict[str, Optional[Span]]]:
+    """用显式栈先序遍历 Span 树，提取所有 Span（深树不会 RecursionError）
+
+    兄弟节点按 start_time 先后访问，得到的顺序父先于子、同层按时间，可直接作为输出序列。
+    同一趟遍历顺带记下 span_id -> 父 Span（根为 None），父子关系直接取自 children_span_list。
+    """
+    spans = []
+    parent_by_id = {root.span_id: None}
+    stack = [root]
+    append = spans.append
+    push = stack.extend
+    pop = stack.pop
+    while stack:
+        span = pop()
+        append(span)
+        children = span.children_span_list
+        for child in children:
+            parent_by_id[child.span_id] = span
+        if len(children) > 1:
+            children = sorted(children, key=_by_start)
+        # 逆序入栈，保证先弹出最早开始的子节点
+        push(reversed(children))
+    return spans, parent_by_id
+
+
+def generate_sequence(spans: List[Span], parent_by_id: Dict[str, Optional[Span]]) -> List[str]:
+    """按已排好的 Span 顺序（extract_spans 的 DFS 顺序）直接生成完整的 Trace 序列"""
+    return [format_edge(span, parent_by_id[span.span_id]) for span in spans]
+
+
+_TRACE_FOOTER = "</Trace Sequence>\n" + "=" * 80 + "\n"
+
+
+def _emit_trace(trace: Trace, output_dir: str) -> None:
+    """生成单个 Trace 的序列文件（进程池任务，需为顶层函数以便 pickle）"""
+    output_file = os.path.join(output_dir, f"{trace.trace_id}.txt")
+
+    # 提取所有 Span（父先于子、兄弟按开始时间）及其父节点索引
+    spans, parent_by_id = extract_spans(trace.root_span)
+
+    # 生成序列
+    sequence_lines = generate_sequence(spans, parent_by_id)
+
+    # 整个文件先拼好，一次 write
+    parts = ["Trace ID is ", str(trace.trace_id), "\n<Trace Sequence>\n"]
+    for line in sequence_lines:
+        parts.append(line)
+        parts.append("\n")
+    parts.append(_TRACE_FOOTER)
+    # trace_id 重复时多个进程会写同一路径：先写本进程的临时文件再 os.replace，避免内容交错或残留
+    tmp = f"{output_file}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write("".join(parts))
+    os.replace(tmp, output_file)
+
+
+def iter_traces(pkl_file: str) -> Iterator[Trace]:
+    """逐个产出 PKL 中的 Trace
+
+    兼容两种写法：整体 dump 的 list[Trace]，以及逐条追加 dump 的 Trace 流。
+    只有后者是真正的流式读取（同时只常驻一条 Trace）；前者一次 load 就得到整个列表，
+    全部 Trace 仍会同时留在内存里，这里只是逐个产出。
+    反序列化期间关闭 GC，避免创建大量对象时反复触发分代回收，结束后恢复调用前的 GC 状态。
+    """
+    with open(pkl_file, 'rb') as f:
+        # 只有在对象边界上读到文件末尾才算正常结束；空文件或被截断的 PKL 照常由 pickle.load 抛错
+        first = True
+        while first or f.peek(1):
+            first = False
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                obj = pickle.load(f)
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+            if isinstance(obj, list):
+                yield from obj
+            else:
+                yield obj
 
 
 def main(pkl_file, output_dir):
     """读取 PKL 文件，生成多条 Trace 的序列并输出为论文格式"""
-    with open(pkl_file, 'rb') as f:
-        traces = pickle.load(f)
+    traces = iter_traces(pkl_file)
+    # iter_traces 是惰性的，先取出第一条：PKL 不存在、为空或损坏时在这里就报错，不会留下空的输出目录
+    first = next(traces, None)
+    if first is not None:
+        traces = itertools.chain((first,), traces)
 
     # 创建输出目录（如果没有的话）
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # 针对每个 Trace，生成对应的文本文件
-    for trace in traces:
-        output_file = os.path.join(output_dir, f"{trace.trace_id}.txt")
-
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(f"Trace ID is {trace.trace_id}\n")
-            f.write("<Trace Sequence>\n")
-
-            # 提取所有 Span
-            spans = extract_spans(trace.root_span)
-
-            # 构建跨 Trace 的依赖关系图
-            dependency_graph = build_dependency_graph(spans)
-
-            # 生成序列
-            sequence_lines = generate_sequence(dependency_graph)
-
-            for line in sequence_lines:
-                f.write(line + "\n")
-
-            f.write("</Trace Sequence>\n")
-            f.write("=" * 80 + "\n")
-
-        print(f"调用链序列已生成并保存到 {output_file}")
+    # 各 Trace 互不依赖，交给进程池并行生成对应的文本文件
+    n = 0
+    with Pool(os.cpu_count()) as pool:
+        for _ in pool.imap_unordered(functools.partial(_emit_trace, output_dir=output_dir), traces, chunksize=64):
+            n += 1
+            if n % 1000 == 0:
+                print(f"已生成 {n} 条调用链序列")
 
+    print(f"调用链序列已生成并保存到 {output_dir}，共 {n} 条")
 
 
-pkl_file = 'D:/文档/trace项目/total/train_normal.pkl'       # 输入 PKL 文件
-output_dir = '../transformed_data/total_transform4/train_normal'  # 输出文件夹
-main(pkl_file, output_dir)
+if __name__ == "__main__":
+    pkl_file = 'D:/文档/trace项目/total/train_normal.pkl'       # 输入 PKL 文件
+    output_dir = '../transformed_data/total_transform4/train_normal'  # 输出文件夹
+    main(pkl_file, output_dir)